@@ -12,7 +12,9 @@ import logging
 import multiprocessing
 import os
 import re
+import sys
 import threading
+import types
 import warnings
 
 
@@ -53,8 +55,8 @@ version_info = tuple([int(num) for num in __version__.split(".")])
 
 # TODO: these are currently treated as case-insensitive; instead we should
 # do "True", "TRUE" etc and ignore "TrUe".
-_STR_BOOL_TRUE = {"1", "yes", "true", "on"}
-_STR_BOOL_FALSE = {"0", "no", "false", "off"}
+_STR_BOOL_TRUE = frozenset(("1", "yes", "true", "on"))
+_STR_BOOL_FALSE = frozenset(("0", "no", "false", "off"))
 _EMAIL_RE = re.compile(r"^.+@.+\..+$")
 # http://stackoverflow.com/a/7995979/376587
 _URL_RE = re.compile(
@@ -70,8 +72,18 @@ _DEFAULT = object()
 _threading_lock = threading.Lock()
 _multiprocessing_lock = multiprocessing.Lock()
 _conf_map = {}
+# names of the register()ed sections (excluding the root one) and
+# whether a root (sectionless) config class was register()ed; both
+# are updated by register() and discard()
+_section_set = set()
+_has_root_flag = False
+# upper cased env var name -> [(section, key), ...] of the setting keys
+# it may override
+_envvar_index = collections.defaultdict(list)
 _parsed = False
 logger = logging.getLogger(__name__)
+# args are only %-formatted if debug logging is enabled
+_log = logger.debug
 
 
 # =============================================================================
@@ -224,21 +236,11 @@ class TypesMismatchError(Error):
 # =============================================================================
 
 
-def _log(s):
-    logger.debug(s)
-
-
 def _has_multi_conf_classes():
     """Return True if more than one config class has been register()ed."""
     return len(_conf_map) > 1
 
 
-def _has_sectionless_conf(cmap=None):
-    if cmap is None:
-        cmap = _conf_map
-    return None in cmap
-
-
 @contextlib.contextmanager
 def _lock_ctx():
     with _threading_lock:
@@ -246,6 +248,51 @@ def _lock_ctx():
             yield
 
 
+_MISSING = object()
+_NON_SETTING_TYPES = (
+    types.FunctionType,
+    types.BuiltinFunctionType,
+    types.MethodType,
+    types.MethodDescriptorType,
+    types.WrapperDescriptorType,
+    types.ClassMethodDescriptorType,
+    types.MethodWrapperType,
+    classmethod,
+    staticmethod,
+    property,
+)
+
+
+def _walk(cls):
+    """Yield (key, value) setting pairs defined by a config class and
+    its bases, skipping private names, routines (functions, methods,
+    method descriptors) and classmethod / staticmethod / property
+    objects. Other callables (e.g. a class
+    used as a default value) are legit settings.
+    """
+    seen = set()
+    for base in cls.__mro__:
+        for k, v in vars(base).items():
+            if k in seen or k.startswith("_"):
+                continue
+            seen.add(k)
+            if isinstance(v, _NON_SETTING_TYPES):
+                continue
+            yield (k, v)
+
+
+def _get_validators(schema_):
+    """Return schema validators (a callable, a sequence of callables
+    or None) as a tuple.
+    """
+    validators = schema_.validator
+    if validators is None:
+        return ()
+    if not _isiter(validators):
+        return (validators,)
+    return tuple(validators)
+
+
 def _isiter(obj):
     try:
         iter(obj)
@@ -304,7 +351,7 @@ def isemail(value):
     """Assert value is a valid email."""
     if not isinstance(value, str):
         raise ValidationError("expected a string, got %r" % value)
-    if re.match(_EMAIL_RE, value) is None:
+    if _EMAIL_RE.match(value) is None:
         raise ValidationError("not a valid email")
     return True
 
@@ -316,16 +363,14 @@ def isurl(value):
     """
     if not isinstance(value, str):
         raise ValidationError("expected a string, got %r" % value)
-    if re.match(_URL_RE, value) is None:
+    if _URL_RE.match(value) is None:
         raise ValidationError("not a valid URL")
     return True
 
 
 def isip46(value):
-    """Assert value is a valid IPv4 or IPv6 address.
-    On Python < 3.3 requires ipaddress module to be installed.
-    """
-    import ipaddress  # requires "pip install ipaddress" on python < 3.3
+    """Assert value is a valid IPv4 or IPv6 address."""
+    import ipaddress
 
     if not isinstance(value, str):
         raise ValidationError("expected a string, got %r" % value)
@@ -354,10 +399,8 @@ def isip4(value):
 
 
 def isip6(value):
-    """Assert value is a valid IPv6 address.
-    On Python < 3.3 requires ipaddress module to be installed.
-    """
-    import ipaddress  # requires "pip install ipaddress" on python < 3.3
+    """Assert value is a valid IPv6 address."""
+    import ipaddress
 
     if not isinstance(value, str):
         raise ValidationError("expected a string, got %r" % value)
@@ -376,7 +419,9 @@ def isip6(value):
 def parse_yaml(file):
     import yaml  # requires pip install pyyaml
 
-    return yaml.load(file, Loader=yaml.FullLoader)
+    # use libyaml-based loader, if available
+    loader = getattr(yaml, "CFullLoader", yaml.FullLoader)
+    return yaml.load(file, Loader=loader)
 
 
 def parse_toml(file):
@@ -395,15 +440,23 @@ def parse_json(file):
 
 
 def parse_ini(file):
-    config = configparser.ConfigParser()
-    config.read(file.name)
-    ret = {}
-    for section, values in config._sections.items():
-        ret[section] = {}
-        for key, value in values.items():
-            ret[section][key] = value
-        ret[section].pop("__name__", None)
-    return ret
+    # Values are read raw (no interpolation), so there's no need for
+    # ConfigParser's interpolation machinery.
+    config = configparser.RawConfigParser()
+    config.read_file(file)
+    return {
+        section: dict(values) for section, values in config._sections.items()
+    }
+
+
+# file extension -> parser function
+_PMAP = {
+    ".yaml": parse_yaml,
+    ".yml": parse_yaml,
+    ".toml": parse_toml,
+    ".json": parse_json,
+    ".ini": parse_ini,
+}
 
 
 # =============================================================================
@@ -448,9 +501,7 @@ def register(section=None):
     class meta_wrapper(type):
         def __iter__(self):  # noqa: N804
             # this will make the class dict()able
-            for k, v in inspect.getmembers(self):
-                if not k.startswith("_") and not inspect.isroutine(v):
-                    yield (k, v)
+            yield from _walk(self)
 
         def __getitem__(self, key):  # noqa: N804
             return getattr(self, key)
@@ -479,10 +530,18 @@ def register(section=None):
                 "register decorator is supposed to be used "
                 "against a class (got %r)" % klass
             )
-        _log("registering %s.%s" % (klass.__module__, klass.__name__))
+        _log("registering %s.%s", klass.__module__, klass.__name__)
+        global _has_root_flag
         with _lock_ctx():
             new_class = add_metaclass(klass)
+            new_class._confix_checks = _compile_checks(section, new_class)
             _conf_map[section] = new_class
+            for key in new_class._confix_checks:
+                _index_envvar(section, key)
+            if section is None:
+                _has_root_flag = True
+            else:
+                _section_set.add(section)
         return new_class
 
     with _lock_ctx():
@@ -498,7 +557,7 @@ def register(section=None):
             warnings.warn(msg, UserWarning, stacklevel=2)
             return lambda klass: add_metaclass(klass)
 
-        if _has_sectionless_conf():
+        if _has_root_flag:
             # There's a root section. Verify the new key does not
             # override any of the keys in the root section.
             root_conf_class = _conf_map.get(None)
@@ -517,6 +576,8 @@ def register(section=None):
     if isinstance(section, str):
         if " " in section or not section.strip():
             raise ValueError("invalid section name %r" % section)
+        # section names are used as dict keys on every parse()
+        section = sys.intern(section)
     return wrapper
 
 
@@ -528,9 +589,10 @@ def get_parsed_conf():
         if not _parsed:
             raise NotParsedError
         conf_map = _conf_map.copy()
+        has_root = _has_root_flag
     ret = {}
     # root section
-    if _has_sectionless_conf(conf_map):
+    if has_root:
         conf_class = conf_map.pop(None)
         ret = dict(conf_class)
     # other sections
@@ -539,6 +601,148 @@ def get_parsed_conf():
     return ret
 
 
+def _cast_bool(value):
+    lowered = value.lower()
+    if lowered in _STR_BOOL_TRUE:
+        return True
+    if lowered in _STR_BOOL_FALSE:
+        return False
+    raise ValueError(value)
+
+
+def _compile_cast(section, key, default_value):
+    """Return a function which casts a string value (coming from an ini
+    file or an env var) to the type of the default value, or None if
+    the string is meant to be left unmodified.
+    """
+    if isinstance(default_value, schema):
+        type_check = default_value.type_check  # per-schema opt
+        default_value = default_value.default
+    else:
+        type_check = None  # global opt, only known at parse() time
+
+    # bool goes first as it's a subclass of int
+    if isinstance(default_value, bool):
+        caster = _cast_bool
+    elif isinstance(default_value, int):
+        caster = int
+    elif isinstance(default_value, float):
+        caster = float
+    else:
+        return None
+
+    def cast(parser, new_value):
+        try:
+            return caster(new_value)
+        except ValueError:
+            if parser.type_check if type_check is None else type_check:
+                raise TypesMismatchError(
+                    section, key, default_value, new_value
+                )
+            return new_value
+
+    return cast
+
+
+def _compile_check(section, key, default_value, cast):
+    """Return a function which validates (and casts, for ini files) a
+    new value for a setting key. Whether the default value is a schema,
+    which type to check against and whether there are validators to
+    run is resolved here once instead of on every parse().
+    """
+    if isinstance(default_value, schema):
+        schema_ = default_value
+        type_check = schema_.type_check
+        type_default = schema_.default
+        validators = _get_validators(schema_)
+    else:
+        type_check = True
+        type_default = default_value
+        validators = ()
+    # a None default matches any type
+    type_check = type_check and type_default is not None
+    default_type = type(type_default)
+
+    def check(parser, new_value):
+        # Cast values for ini files (which only support string type).
+        if cast is not None and parser.file_ext == ".ini":
+            new_value = cast(parser, new_value)
+        # Look for type mismatch (unless disabled via parse() opt).
+        if (
+            type_check
+            and parser.type_check
+            and new_value is not None
+            and type(new_value) is not default_type
+        ):
+            raise TypesMismatchError(section, key, type_default, new_value)
+        # Run validators.
+        if validators:
+            parser.run_validators(validators, section, key, new_value)
+        return new_value
+
+    return check
+
+
+def _compile(section, key, default_value):
+    """Return a (default_value, cast, check) tuple for a setting key."""
+    cast = _compile_cast(section, key, default_value)
+    check = _compile_check(section, key, default_value, cast)
+    return (default_value, cast, check)
+
+
+def _compile_checks(section, conf_class):
+    """Return a {key: (default_value, cast, check)} dict for all the
+    setting keys defined by a config class.
+    """
+    return {
+        key: _compile(section, key, value)
+        for key, value in _walk(conf_class)
+    }
+
+
+def _get_compiled(section, key, conf_class):
+    """Return the (default_value, cast, check) tuple for a setting key
+    or None if the config class has no such setting. The class is
+    looked up on every call: if the key was added, or its default value
+    replaced, after register() the tuple is compiled again.
+    """
+    checks = conf_class._confix_checks
+    compiled = checks.get(key)
+    default_value = getattr(conf_class, key, _MISSING)
+    if compiled is not None and compiled[0] is default_value:
+        # fast path: unchanged since register()
+        return compiled
+    if (
+        key.startswith("_")
+        or default_value is _MISSING
+        or isinstance(default_value, _NON_SETTING_TYPES)
+    ):
+        return None
+    if compiled is None:
+        _index_envvar(section, key)
+    compiled = checks[key] = _compile(section, key, default_value)
+    return compiled
+
+
+def _index_envvar(section, key):
+    """Add a setting key to the env var index."""
+    env_name = key.upper()
+    # only upper cased env vars are taken into account
+    if env_name.isupper():
+        _envvar_index[env_name].append((section, key))
+
+
+def _index_new_keys(section, conf_class):
+    """Compile and index the setting keys which were added to a config
+    class after register().
+    """
+    checks = conf_class._confix_checks
+    for key, value in _walk(conf_class):
+        if key not in checks:
+            checks[key] = _compile(section, key, value)
+            _index_envvar(section, key)
+
+
 class _Parser:
     def __init__(
         self,
@@ -581,18 +785,11 @@ class _Parser:
         # parse conf file
         if isinstance(self.conf_file, str):
             file = open(self.conf_file)
-            _log("using conf file %s" % (self.conf_file))
+            _log("using conf file %s", self.conf_file)
         else:
             file = self.conf_file
-            _log("using conf file-like object %s" % (self.conf_file))
+            _log("using conf file-like object %s", self.conf_file)
         with file:
-            pmap = {
-                ".yaml": parse_yaml,
-                ".yml": parse_yaml,
-                ".toml": parse_toml,
-                ".json": parse_json,
-                ".ini": parse_ini,
-            }
             if self.file_parser is None:
                 if not hasattr(file, "name"):
                     raise Error(
@@ -601,13 +798,13 @@ class _Parser:
                     )
                 try:
                     self.file_ext = os.path.splitext(file.name)[1]
-                    parser = pmap[self.file_ext]
+                    parser = _PMAP[self.file_ext]
                 except KeyError:
                     raise ValueError(
                         "don't know how to parse %r (extension "
                         "not supported)" % file.name
                     )
-                if self.file_ext == ".ini" and _has_sectionless_conf():
+                if self.file_ext == ".ini" and _has_root_flag:
                     raise Error(
                         "can't parse ini files if a sectionless "
                         "configuration class has been registered"
@@ -617,70 +814,35 @@ class _Parser:
             return parser(file) or {}
 
     def update_conf_from_envvars(self):
-        """Iterate over all process env vars and return a dict() of
-        env vars whose name match they setting keys defined by conf
-        class.
+        """Look up the env vars whose name match the setting keys
+        defined by conf classes (as indexed by register(), plus keys
+        added to the classes since) and add them to the new conf.
         """
         conf_map = _conf_map.copy()
-        env = os.environ.copy()
-        env_names = {x for x in env if x.isupper()}
         for section, conf_class in conf_map.items():
-            for key_name in dict(conf_class):
-                check_name = (
-                    key_name.upper()
-                    if not self.envvar_case_sensitive
-                    else key_name
-                )
-                if check_name in env_names:
-                    default_value = getattr(conf_class, key_name)
-                    raw_value = env[key_name.upper()]
-                    new_value = self.cast_value(
-                        section, key_name, default_value, raw_value
-                    )
-                    if section is None:
-                        self.new_conf[key_name] = new_value
-                    else:
-                        if section not in self.new_conf:
-                            self.new_conf[section] = {}
-                        self.new_conf[section][key_name] = new_value
-
-    def cast_value(self, section, key, default_value, new_value):
-        """Cast a value depending on default value type."""
-        type_check = self.type_check  # global opt
-        if isinstance(default_value, schema):
-            type_check = default_value.type_check  # per-schema opt
-            default_value = default_value.default
-
-        if isinstance(default_value, bool):
-            if new_value.lower() in _STR_BOOL_TRUE:
-                new_value = True
-            elif new_value.lower() in _STR_BOOL_FALSE:
-                new_value = False
-            else:
-                if type_check:
-                    raise TypesMismatchError(
-                        section, key, default_value, new_value
-                    )
-        elif isinstance(default_value, int):
-            try:
-                new_value = int(new_value)
-            except ValueError:
-                if type_check:
-                    raise TypesMismatchError(
-                        section, key, default_value, new_value
-                    )
-        elif isinstance(default_value, float):
-            try:
-                new_value = float(new_value)
-            except ValueError:
-                if type_check:
-                    raise TypesMismatchError(
-                        section, key, default_value, new_value
-                    )
-        else:
-            # leave the new value unmodified (str)
-            pass
-        return new_value
+            _index_new_keys(section, conf_class)
+        for env_name, targets in _envvar_index.items():
+            raw_value = os.environ.get(env_name)
+            if raw_value is None:
+                continue
+            for section, key_name in targets:
+                if self.envvar_case_sensitive and key_name != env_name:
+                    continue
+                compiled = _get_compiled(section, key_name, conf_map[section])
+                if compiled is None:
+                    # the setting key was removed after register()
+                    continue
+                cast = compiled[1]
+                if cast is None:
+                    new_value = raw_value
+                else:
+                    new_value = cast(self, raw_value)
+                if section is None:
+                    self.new_conf[key_name] = new_value
+                else:
+                    if section not in self.new_conf:
+                        self.new_conf[section] = {}
+                    self.new_conf[section][key_name] = new_value
 
     def process_conf(self, new_conf):
         conf_map = _conf_map.copy()
@@ -690,7 +852,7 @@ class _Parser:
         for key, new_value in new_conf.items():
             # this should never happen
             assert key is not None, key
-            if key in conf_map:
+            if key in _section_set:
                 # We're dealing with a section.
                 # Possibly we may have multiple regeister()ed conf classes.
                 # "new_value" in this case is actually a dict of sub-section
@@ -718,36 +880,29 @@ class _Parser:
         config file or env vars process it (validate it) and override
         the config class original key value.
         """
-        try:
-            # The default value defined in the conf class.
-            default_value = getattr(conf_class, key)
-        except AttributeError:
-            # Conf file defines a key which does not exist in the
-            # conf class.
-            raise UnrecognizedSettingKeyError(section, key, new_value)
-
-        # Cast values for ini files (which only support string type).
-        if self.file_ext == ".ini":
-            new_value = self.cast_value(section, key, default_value, new_value)
-
-        # Look for type mismatch.
-        is_schema = isinstance(default_value, schema)
-        if not is_schema:
-            self.check_type(section, key, default_value, new_value)
-        else:
-            schema_ = default_value
-            if schema_.type_check:
-                self.check_type(section, key, schema_.default, new_value)
-
-        # Run validators.
-        if is_schema:
-            schema_ = default_value
-            if schema_.validator is not None:
-                self.run_validators(schema_, section, key, new_value)
+        # Precompiled by register(); only looked up again if the class
+        # changed since.
+        compiled = conf_class._confix_checks.get(key)
+        if compiled is None or compiled[0] is not getattr(
+            conf_class, key, _MISSING
+        ):
+            compiled = _get_compiled(section, key, conf_class)
+            if compiled is None:
+                # Conf file defines a key which does not exist in the
+                # conf class.
+                raise UnrecognizedSettingKeyError(section, key, new_value)
+        check = compiled[2]
+
+        # Cast, look for type mismatch and run validators.
+        new_value = check(self, new_value)
 
         # Finally replace key value.
-        # sec_key = key if section is None else "%s.%s" % (section, key)
-        _log("overriding setting key %r (value=%r) to new value %r".format())
+        _log(
+            "overriding setting key %r (section=%r) with value %r",
+            key,
+            section,
+            new_value,
+        )
         setattr(conf_class, key, new_value)
 
     def check_type(self, section, key, default_value, new_value):
@@ -764,15 +919,19 @@ class _Parser:
             raise TypesMismatchError(section, key, default_value, new_value)
 
     @staticmethod
-    def run_validators(schema_, section, key, new_value):
-        """Run schema validators and raise ValidationError on failure."""
-        validators = schema_.validator
-        if not _isiter(validators):
-            validators = [validators]
+    def run_validators(validators, section, key, new_value):
+        """Run a tuple of schema validators and raise ValidationError
+        on failure.
+        """
         for validator in validators:
             exc = None
-            # sec_key = key if section is None else "%s.%s" % (section, key)
-            _log("running validator %r for key %r with value " "%r".format())
+            _log(
+                "running validator %r for key %r (section=%r) with value %r",
+                validator,
+                key,
+                section,
+                new_value,
+            )
             try:
                 ok = validator(new_value)
             except ValidationError as err:
@@ -793,13 +952,16 @@ class _Parser:
         """
         conf_map = _conf_map.copy()
         for section, conf_class in conf_map.items():
-            for key, value in conf_class.__dict__.items():
+            # materialize the walk first as we setattr() on the class
+            for key, value in list(_walk(conf_class)):
                 if isinstance(value, schema):
                     schema_ = value
                     if schema_.required:
                         raise RequiredSettingKeyError(section, key)
                     if schema_.validator is not None:
-                        _Parser.run_validators(schema_, section, key, value)
+                        _Parser.run_validators(
+                            _get_validators(schema_), section, key, value
+                        )
                     setattr(conf_class, key, value.default)
 
 
@@ -857,7 +1019,10 @@ def parse_with_envvars(
 
 def discard():
     """Discard previous configuration (if any)."""
-    global _parsed
+    global _parsed, _has_root_flag
     with _lock_ctx():
         _conf_map.clear()
+        _section_set.clear()
+        _envvar_index.clear()
+        _has_root_flag = False
         _parsed = False
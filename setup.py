@@ -2,11 +2,7 @@
 
 import os
 
-
-try:
-    from setuptools import setup
-except ImportError:
-    from distutils.core import setup
+from setuptools import setup
 
 
 HERE = os.path.abspath(os.path.dirname(__file__))
@@ -55,7 +51,6 @@ def main():
         ],
         # ...supposed to be installed by user if needed
         extra_requires=dict(
-            ipaddress="ipaddress",
             toml="toml",
             yaml="PyYAML",
         ),
@@ -65,7 +60,6 @@ def main():
             "Intended Audience :: System Administrators",
             "License :: OSI Approved :: MIT License",
             "Operating System :: OS Independent",
-            "Programming Language :: Python :: 2",
             "Programming Language :: Python :: 3",
             "Programming Language :: Python",
             "Topic :: Security",
@@ -1,15 +1,12 @@
-import configparser
-import errno
-import imp
+import importlib.util
 import io
 import json
 import os
-import textwrap
+import tempfile
+import types
 import unittest
 import warnings
-
-import toml  # requires "pip install toml"
-import yaml  # requires "pip install pyyaml"
+from unittest import mock
 
 import confix
 from confix import AlreadyParsedError
@@ -36,16 +33,96 @@ from confix import register
 from confix import schema
 
 
-THIS_MODULE = os.path.splitext(os.path.basename(__file__))[0]
-TESTFN = "$testfile"
+# set TMPDIR=/dev/shm to keep test files in memory
+TESTFN = os.path.join(tempfile.gettempdir(), "$testfile-%s" % os.getpid())
+# ext -> (fd, path) of the conf files shared by all test classes
+# using that extension; populated by setUpModule()
+TESTFILES = {}
+# (serializer, repr(dict)) -> serialized bytes; many tests write the
+# very same payload (e.g. {"foo": 5})
+SERIALIZED = {}
+# INI conf overriding "foo" setting key of "name" section
+INI_TMPL = "[name]\nfoo = %s\n"
+TRUE_VALUES = ("1", "yes", "true", "on", "YES", "TRUE", "ON")
+FALSE_VALUES = ("0", "no", "false", "off", "NO", "FALSE", "OFF")
+# optional deps; they're imported lazily, only by the tests using them
+HAS_ORJSON = importlib.util.find_spec("orjson") is not None
+HAS_TOML = importlib.util.find_spec("toml") is not None
+HAS_YAML = importlib.util.find_spec("yaml") is not None
+
+
+# --- validators used by tests
+
+
+def _is_int(x):
+    return isinstance(x, int)
+
+
+def _is_str(x):
+    return isinstance(x, str)
+
+
+def _fail_w_message(x):
+    raise ValidationError("message")
+
+
+def _fail_w_no_message(x):
+    raise ValidationError
+
+
+# --- serializers used by format mixins
+
+
+def _dump_yaml(dct):
+    import yaml  # requires "pip install pyyaml"
+
+    # libyaml-based dumper, if available
+    dumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+    return yaml.dump(dct, Dumper=dumper, default_flow_style=False)
+
+
+def _dump_json(dct):
+    if HAS_ORJSON:
+        import orjson
+
+        return orjson.dumps(dct)  # bytes
+    return json.dumps(dct)
 
 
-def safe_remove(path):
-    try:
-        os.remove(path)
-    except OSError as err:
-        if err.errno != errno.ENOENT:
-            raise
+def _dump_toml(dct):
+    import toml  # requires "pip install toml"
+
+    return toml.dumps(dct)
+
+
+def _dump_ini(dct):
+    lines = []
+    for section, values in dct.items():
+        assert isinstance(section, str)
+        lines.append("[%s]" % section)
+        for key, value in values.items():
+            lines.append("%s = %s" % (key, value))
+        lines.append("")
+    return "\n".join(lines) + "\n"
+
+
+def setUpModule():
+    # a conf file with no (hence unsupported) extension
+    with open(TESTFN, "w") as f:
+        f.write("foo")
+    for ext in (".ini", ".json", ".toml", ".yaml"):
+        TESTFILES[ext] = tempfile.mkstemp(prefix="confix-", suffix=ext)
+
+
+def tearDownModule():
+    for fd, _ in TESTFILES.values():
+        os.close(fd)
+    for path in [TESTFN] + [path for _, path in TESTFILES.values()]:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+    TESTFILES.clear()
 
 
 # ===================================================================
@@ -54,23 +131,53 @@ def safe_remove(path):
 
 
 class BaseTestCase(unittest.TestCase):
+    # If set, a TESTFN with this extension is created for the class.
+    EXT = None
+
+    @classmethod
+    def setUpClass(cls):
+        # TESTFN is kept open for the whole module so that writing it
+        # doesn't cost an open() / close() per test (or per class).
+        if cls.EXT is not None:
+            cls._fd, cls.TESTFN = TESTFILES[cls.EXT]
+
     def setUp(self):
         discard()
-        self.original_environ = os.environ.copy()
-        if getattr(self, "TESTFN", None) is not None:
-            safe_remove(self.TESTFN)
+        # env var name -> original value (None if it wasn't set)
+        self._env_overrides = {}
 
     def tearDown(self):
         discard()
-        os.environ.clear()
-        os.environ.update(self.original_environ)
-        if getattr(self, "TESTFN", None) is not None:
-            safe_remove(self.TESTFN)
+        for name, value in self._env_overrides.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+    def setenv(self, name, value):
+        """Set an env var which will be restored by tearDown()."""
+        self._env_overrides.setdefault(name, os.environ.get(name))
+        os.environ[name] = value
+
+    def update_env(self, mapping):
+        """Set many env vars at once; tearDown() restores them."""
+        for name in mapping:
+            self._env_overrides.setdefault(name, os.environ.get(name))
+        os.environ.update(mapping)
 
     @classmethod
     def write_to_file(cls, content, fname=None):
-        with open(fname or cls.TESTFN, "w") as f:
-            f.write(content)
+        """Write str or bytes content to TESTFN (or fname)."""
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        if fname is not None:
+            with open(fname, "wb") as f:
+                f.write(content)
+            return
+        # os.pwrite() is not available on Windows
+        os.ftruncate(cls._fd, 0)
+        os.lseek(cls._fd, 0, os.SEEK_SET)
+        os.write(cls._fd, content)
 
     def parse(self, *args, **kwargs):
         parse(*args, **kwargs)
@@ -84,6 +191,8 @@ class BaseMixin:
 
     TESTFN = None
     section = None
+    # a function serializing a dict to str or bytes
+    SERIALIZER = None
 
     def setUp(self):
         super().setUp()
@@ -94,7 +203,21 @@ class BaseMixin:
         self.section = self.original_section
 
     def dict_to_file(self, dct):
-        raise NotImplementedError("must be implemented in subclass")
+        if not dct:
+            # all formats treat an empty file as an empty conf
+            self.write_to_file("")
+            return
+        if self.section:
+            dct = {self.section: dct}
+        key = (self.SERIALIZER, repr(dct))
+        try:
+            content = SERIALIZED[key]
+        except KeyError:
+            content = self.SERIALIZER(dct)
+            if isinstance(content, str):
+                content = content.encode("utf-8")
+            SERIALIZED[key] = content
+        self.write_to_file(content)
 
     # --- base tests
 
@@ -288,7 +411,7 @@ class BaseMixin:
     def test_validator_ok(self):
         @register(self.section)
         class config:
-            foo = schema(10, validator=lambda x: isinstance(x, int))
+            foo = schema(10, validator=_is_int)
 
         self.dict_to_file(dict(foo=5))
         self.parse(self.TESTFN)
@@ -296,7 +419,7 @@ class BaseMixin:
     def test_validator_ko(self):
         @register(self.section)
         class config:
-            foo = schema(10, validator=lambda x: isinstance(x, str))
+            foo = schema(10, validator=_is_str)
 
         self.dict_to_file(dict(foo=5))
         with self.assertRaises(ValidationError) as cm:
@@ -306,12 +429,9 @@ class BaseMixin:
         assert cm.exception.value == 5
 
     def test_validator_ko_custom_exc_w_message(self):
-        def validator(value):
-            raise ValidationError("message")
-
         @register(self.section)
         class config:
-            foo = schema(10, validator=validator)
+            foo = schema(10, validator=_fail_w_message)
 
         self.dict_to_file(dict(foo=5))
 
@@ -323,12 +443,9 @@ class BaseMixin:
         assert cm.exception.msg == "message"
 
     def test_validator_ko_custom_exc_w_no_message(self):
-        def validator(value):
-            raise ValidationError
-
         @register(self.section)
         class config:
-            foo = schema(10, validator=validator)
+            foo = schema(10, validator=_fail_w_no_message)
 
         self.dict_to_file(dict(foo=5))
 
@@ -351,8 +468,8 @@ class BaseMixin:
             apple = 3
 
         self.dict_to_file(dict(foo=5))
-        os.environ["APPLE"] = "10"
-        self.parse_with_envvars(self.TESTFN)
+        with mock.patch.dict(os.environ, {"APPLE": "10"}):
+            self.parse_with_envvars(self.TESTFN)
         assert config.foo == 5
         assert config.bar == 2
         assert config.apple == 10
@@ -364,8 +481,8 @@ class BaseMixin:
             foo = 1
 
         self.dict_to_file(dict(foo=5))
-        os.environ["FOO"] = "6"
-        self.parse_with_envvars(self.TESTFN)
+        with mock.patch.dict(os.environ, {"FOO": "6"}):
+            self.parse_with_envvars(self.TESTFN)
         assert config.foo == 6
 
     def test_envvars_case_sensitive(self):
@@ -376,10 +493,9 @@ class BaseMixin:
             APPLE = 3
 
         # non-uppercase env vars are supposed to be ignored
-        os.environ["FoO"] = "10"  # noqa
-        os.environ["BAR"] = "20"
-        os.environ["APPLE"] = "30"
-        parse_with_envvars(case_sensitive=True)
+        env = {"FoO": "10", "BAR": "20", "APPLE": "30"}
+        with mock.patch.dict(os.environ, env):
+            parse_with_envvars(case_sensitive=True)
         assert config.foo == 1
         assert config.bar == 2
         assert config.APPLE == 30
@@ -393,16 +509,26 @@ class BaseMixin:
             PeAr = 4
 
         # non-uppercase env vars are supposed to be ignored
-        os.environ["FoO"] = "10"  # noqa
-        os.environ["BAR"] = "20"
-        os.environ["APPLE"] = "30"
-        os.environ["PEAR"] = "40"
-        parse_with_envvars(case_sensitive=False)
+        env = {"FoO": "10", "BAR": "20", "APPLE": "30", "PEAR": "40"}
+        with mock.patch.dict(os.environ, env):
+            parse_with_envvars(case_sensitive=False)
         assert config.foo == 1
         assert config.bar == 20
         assert config.APPLE == 30
         assert config.PeAr == 40
 
+    def _expect_envvar_mismatch(self, envname, envval, key, default):
+        # A failed parse doesn't mark the conf as parsed, so the same
+        # registered class can be reused for multiple cases.
+        patched_env = mock.patch.dict(os.environ, {envname: envval})
+        with patched_env, self.assertRaises(TypesMismatchError) as cm:
+            parse_with_envvars()
+        assert cm.exception.section == self.section
+        assert cm.exception.key == key
+        assert cm.exception.default_value == default
+        assert type(cm.exception.default_value) is type(default)
+        assert cm.exception.new_value == envval
+
     def test_envvars_type_mismatch(self):
         @register(self.section)
         class config:
@@ -410,34 +536,13 @@ class BaseMixin:
             some_float = 0.1
             some_bool = True
 
-        # int
-        os.environ["SOME_INT"] = "foo"
-        with self.assertRaises(TypesMismatchError) as cm:
-            parse_with_envvars()
-        assert cm.exception.section == self.section
-        assert cm.exception.key == "some_int"
-        assert cm.exception.default_value == 1
-        assert cm.exception.new_value == "foo"
-        del os.environ["SOME_INT"]
-
-        # float
-        os.environ["SOME_FLOAT"] = "foo"
-        with self.assertRaises(TypesMismatchError) as cm:
-            parse_with_envvars()
-        assert cm.exception.section == self.section
-        assert cm.exception.key == "some_float"
-        assert cm.exception.default_value == 0.1
-        assert cm.exception.new_value == "foo"
-        del os.environ["SOME_FLOAT"]
-
-        # bool
-        os.environ["SOME_BOOL"] = "foo"
-        with self.assertRaises(TypesMismatchError) as cm:
-            parse_with_envvars()
-        assert cm.exception.section == self.section
-        assert cm.exception.key == "some_bool"
-        assert cm.exception.default_value is True
-        assert cm.exception.new_value == "foo"
+        for envname, key, default in (
+            ("SOME_INT", "some_int", 1),
+            ("SOME_FLOAT", "some_float", 0.1),
+            ("SOME_BOOL", "some_bool", True),
+        ):
+            with self.subTest(key=key):
+                self._expect_envvar_mismatch(envname, "foo", key, default)
 
     # --- test multiple sections
 
@@ -518,14 +623,10 @@ class BaseMixin:
 # yaml
 
 
+@unittest.skipUnless(HAS_YAML, "yaml module not installed")
 class TestYamlMixin(BaseMixin, BaseTestCase):
-    TESTFN = TESTFN + ".yaml"
-
-    def dict_to_file(self, dct):
-        if self.section:
-            dct = {self.section: dct}
-        s = yaml.dump(dct, default_flow_style=False)
-        self.write_to_file(s)
+    EXT = ".yaml"
+    SERIALIZER = staticmethod(_dump_yaml)
 
 
 class TestYamlWithSectionMixin(TestYamlMixin):
@@ -536,12 +637,8 @@ class TestYamlWithSectionMixin(TestYamlMixin):
 
 
 class TestJsonMixin(BaseMixin, BaseTestCase):
-    TESTFN = TESTFN + ".json"
-
-    def dict_to_file(self, dct):
-        if self.section:
-            dct = {self.section: dct}
-        self.write_to_file(json.dumps(dct))
+    EXT = ".json"
+    SERIALIZER = staticmethod(_dump_json)
 
 
 class TestJsonWithSectionMixin(TestJsonMixin):
@@ -551,14 +648,10 @@ class TestJsonWithSectionMixin(TestJsonMixin):
 # toml
 
 
+@unittest.skipUnless(HAS_TOML, "toml module not installed")
 class TestTomlMixin(BaseMixin, BaseTestCase):
-    TESTFN = TESTFN + ".toml"
-
-    def dict_to_file(self, dct):
-        if self.section:
-            dct = {self.section: dct}
-        s = toml.dumps(dct)
-        self.write_to_file(s)
+    EXT = ".toml"
+    SERIALIZER = staticmethod(_dump_toml)
 
 
 class TestTomWithSectionlMixin(TestTomlMixin):
@@ -569,30 +662,16 @@ class TestTomWithSectionlMixin(TestTomlMixin):
 
 
 class TestIniMixin(BaseMixin, BaseTestCase):
-    TESTFN = TESTFN + "testfile.ini"
+    EXT = ".ini"
+    SERIALIZER = staticmethod(_dump_ini)
     section = "name"
 
-    def dict_to_file(self, dct):
-        if not self._testMethodName.startswith("test_multisection"):
-            dct = {self.section: dct}
-        config = configparser.RawConfigParser()
-        for section, values in dct.items():
-            assert isinstance(section, str)
-            config.add_section(section)
-            for key, value in values.items():
-                config.set(section, key, value)
-        fl = io.StringIO()
-        config.write(fl)
-        fl.seek(0)
-        content = fl.read()
-        self.write_to_file(content)
-
 
 # env vars
 
 
 class TestEnvVarsMixin(BaseMixin, BaseTestCase):
-    TESTFN = TESTFN + "testfile.ini"
+    EXT = ".ini"
 
     def setUp(self):
         super().setUp()
@@ -606,8 +685,7 @@ class TestEnvVarsMixin(BaseMixin, BaseTestCase):
         parse_with_envvars(**kwargs)
 
     def dict_to_file(self, dct):
-        for k, v in dct.items():
-            os.environ[k.upper()] = str(v)
+        self.update_env({k.upper(): str(v) for k, v in dct.items()})
 
     @unittest.skip("")
     def test_unrecognized_key(self):
@@ -622,7 +700,7 @@ class TestEnvVarsMixin(BaseMixin, BaseTestCase):
 
 
 class TestIni(BaseTestCase):
-    TESTFN = TESTFN + ".ini"
+    EXT = ".ini"
 
     def test_sectionless_conf(self):
         @register()
@@ -637,68 +715,87 @@ class TestIni(BaseTestCase):
             self.TESTFN,
         )
 
+    def test_file_like(self):
+        # INI content is read from the file object, not from its path.
+        @register("name")
+        class config:
+            foo = 1
+
+        file = io.StringIO(INI_TMPL % "5")
+        file.name = "in-memory.ini"
+        self.parse(file)
+        assert config.foo == 5
+
     def test_true_type(self):
-        for value in ("1", "yes", "true", "on", "YES", "TRUE", "ON"):
+        for value in TRUE_VALUES:
+            with self.subTest(value=value):
+                # a failed sub test must not leak its registration
+                discard()
 
-            @register("name")
-            class config:
-                foo = False
+                @register("name")
+                class config:
+                    foo = False
 
-            self.write_to_file(
-                textwrap.dedent(
-                    """
-                [name]
-                foo = %s
-            """
-                    % (value)
-                )
-            )
-            self.parse(self.TESTFN)
-            assert config.foo is True
-            discard()
+                self.write_to_file(INI_TMPL % value)
+                self.parse(self.TESTFN)
+                assert config.foo is True
 
     def test_false_type(self):
-        for value in ("0", "no", "false", "off", "NO", "FALSE", "OFF"):
+        for value in FALSE_VALUES:
+            with self.subTest(value=value):
+                # a failed sub test must not leak its registration
+                discard()
 
-            @register("name")
-            class config:
-                foo = True
+                @register("name")
+                class config:
+                    foo = True
 
-            self.write_to_file(
-                textwrap.dedent(
-                    """
-                [name]
-                foo = %s
-            """
-                    % (value)
-                )
-            )
-            self.parse(self.TESTFN)
-            assert config.foo is False
-            discard()
+                self.write_to_file(INI_TMPL % value)
+                self.parse(self.TESTFN)
+                assert config.foo is False
 
 
 class TestEnvVars(BaseTestCase):
+    def test_default_changed_after_register(self):
+        @register()
+        class config:
+            foo = 1
+
+        config.foo = 1.5
+        self.setenv("FOO", "2.5")
+        self.parse_with_envvars()
+        assert config.foo == 2.5
+
+    def test_key_added_after_register(self):
+        @register()
+        class config:
+            foo = 1
+
+        config.bar = 2
+        self.setenv("BAR", "3")
+        self.parse_with_envvars()
+        assert config.bar == 3
+
     def test_true_type(self):
-        for value in ("1", "yes", "true", "on", "YES", "TRUE", "ON"):
+        for value in TRUE_VALUES:
 
             @register()
             class config:
                 foo = False
 
-            os.environ["FOO"] = value
+            self.setenv("FOO", value)
             self.parse_with_envvars()
             assert config.foo is True
             discard()
 
     def test_false_type(self):
-        for value in ("0", "no", "false", "off", "NO", "FALSE", "OFF"):
+        for value in FALSE_VALUES:
 
             @register("name")
             class config:
                 foo = True
 
-            os.environ["FOO"] = value
+            self.setenv("FOO", value)
             self.parse_with_envvars()
             assert config.foo is False
             discard()
@@ -824,10 +921,7 @@ class TestParse(BaseTestCase):
         assert config.bar == 10
 
     def test_conf_file_w_unknown_ext(self):
-        # Conf file with unsupported extension.
-        with open(TESTFN, "w") as f:
-            f.write("foo")
-        self.addCleanup(safe_remove, TESTFN)
+        # Conf file with unsupported extension (see setUpModule()).
         with self.assertRaises(ValueError) as cm:
             parse(TESTFN)
         assert "don't know how to parse" in str(cm.exception)
@@ -862,6 +956,50 @@ class TestParse(BaseTestCase):
         file = io.StringIO()
         parse(file, file_parser=lambda x: {})  # noqa
 
+    def test_method_is_not_a_setting_key(self):
+        @register()
+        class config:
+            foo = 1
+
+            @classmethod
+            def some_method(cls):
+                return 1
+
+        with self.assertRaises(UnrecognizedSettingKeyError) as cm:
+            parse(io.StringIO(), file_parser=lambda x: {"some_method": 2})
+        assert cm.exception.key == "some_method"
+
+    def test_inherited_schema(self):
+        # Schemas defined in a base class are supposed to be processed.
+        class base:
+            foo = schema(10, required=True)
+
+        @register()
+        class config(base):
+            bar = schema(20)
+
+        with self.assertRaises(RequiredSettingKeyError) as cm:
+            parse()
+        assert cm.exception.key == "foo"
+
+    def test_default_changed_after_register(self):
+        @register()
+        class config:
+            foo = 1
+
+        config.foo = "x"
+        parse(io.StringIO(), file_parser=lambda x: {"foo": "y"})
+        assert config.foo == "y"
+
+    def test_key_added_after_register(self):
+        @register()
+        class config:
+            foo = 1
+
+        config.bar = 2
+        parse(io.StringIO(), file_parser=lambda x: {"bar": 3})
+        assert config.bar == 3
+
     def test_parse_called_twice(self):
         @register()
         class config:
@@ -1032,6 +1170,47 @@ class TestRegister(BaseTestCase):
         assert dict(config) == {"foo": 1, "bar": 2}
         assert config.some_method() == 1
 
+    def test_dictify_inheritance(self):
+        class base:
+            foo = 1
+            bar = 2
+
+        @register()
+        class config(base):
+            bar = 3
+
+            @staticmethod
+            def some_static():
+                return 1
+
+            @property
+            def some_property(self):
+                return 1
+
+        assert dict(config) == {"foo": 1, "bar": 3}
+
+    def test_class_as_default_value(self):
+        @register()
+        class config:
+            factory = dict
+            foo = 1
+
+        assert dict(config) == {"factory": dict, "foo": 1}
+        parse(io.StringIO(), file_parser=lambda x: {"factory": list})
+        assert config.factory is list
+
+    def test_method_descriptor_is_not_a_setting_key(self):
+        @register()
+        class config:
+            norm = str.lower
+            wrapper = str.__add__
+            foo = 1
+
+        assert dict(config) == {"foo": 1}
+        with self.assertRaises(UnrecognizedSettingKeyError) as cm:
+            parse(io.StringIO(), file_parser=lambda x: {"norm": 1})
+        assert cm.exception.key == "norm"
+
     def test_special_methods(self):
         @register()
         class config:
@@ -1169,19 +1348,16 @@ class TestMisc(BaseTestCase):
         for name in dir_confix:
             if name in ("configparser", "logger", "basestring", "unicode"):
                 continue
-            if not name.startswith("_"):
-                try:
-                    __import__(name)
-                except ImportError:
-                    if name not in confix.__all__:
-                        fun = getattr(confix, name)
-                        if fun is None:
-                            continue
-                        if (
-                            fun.__doc__ is not None
-                            and "deprecated" not in fun.__doc__.lower()
-                        ):
-                            self.fail("%r not in confix.__all__" % name)
+            if not name.startswith("_") and name not in confix.__all__:
+                fun = getattr(confix, name)
+                # skip modules imported by confix (os, re, ...)
+                if fun is None or isinstance(fun, types.ModuleType):
+                    continue
+                if (
+                    fun.__doc__ is not None
+                    and "deprecated" not in fun.__doc__.lower()
+                ):
+                    self.fail("%r not in confix.__all__" % name)
 
         # Import 'star' will break if __all__ is inconsistent, see:
         # https://github.com/giampaolo/psutil/issues/656
@@ -1199,7 +1375,9 @@ class TestMisc(BaseTestCase):
     def test_setup_script(self):
         here = os.path.abspath(os.path.dirname(__file__))
         setup_py = os.path.realpath(os.path.join(here, "setup.py"))
-        module = imp.load_source("setup", setup_py)
+        spec = importlib.util.spec_from_file_location("setup", setup_py)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
         self.assertRaises(SystemExit, module.setup)
         assert module.get_version() == confix.__version__
 